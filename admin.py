@@ -0,0 +1,70 @@
+from flask import g, request, jsonify
+from functools import wraps
+from sharding import connect_shard, locate_id
+import os
+
+# Kept apart from auth.py (and free of flasgger and jwt imports) because the
+# GraphQL app loads the admin routes too and should start quickly
+
+SECRET_KEY = os.environ.get(
+    "SECRET_KEY", "1237ac0393917173029ad602d3152bd523ce383e9a89790b098fbf4c6a461ad8"
+)
+if not SECRET_KEY:
+    raise ValueError("No SECRET_KEY set for Flask application")
+
+
+# Error response unless the request carries a logged-in admin's Bearer JWT
+def check_admin():
+    if g.get("admin_id") is not None:
+        return None  # Already checked for this request
+
+    auth_header = request.headers.get("Authorization", "")
+    if not auth_header.startswith("Bearer "):
+        return jsonify({"error": "Missing bearer token"}), 401
+
+    # Imported on first use: jwt pulls in cryptography, slow to import
+    import jwt
+
+    try:
+        payload = jwt.decode(
+            auth_header[len("Bearer ") :], SECRET_KEY, algorithms=["HS256"]
+        )
+    except jwt.InvalidTokenError:
+        return jsonify({"error": "Invalid or expired token"}), 401
+
+    conn = connect_shard(locate_id(payload.get("user_id")))
+    try:
+        user = conn.execute(
+            "SELECT role FROM users WHERE id = ?", (payload.get("user_id"),)
+        ).fetchone()
+    finally:
+        conn.close()
+    if user is None or user["role"] != "admin":
+        return jsonify({"error": "Admin access required"}), 403
+
+    g.admin_id = payload.get("user_id")
+    return None
+
+
+# Decorator for routes that require a logged-in admin (Bearer JWT from /login)
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        error = check_admin()
+        if error:
+            return error
+        return view(*args, **kwargs)
+
+    # Lets body validation authenticate the caller before looking at the body
+    wrapper.admin_required = True
+    return wrapper
+
+
+# Attach Swagger specs to a view like flasgger's swag_from(dict) does, without
+# importing flasgger; Swagger in app.py reads them from view.specs_dict
+def swag_specs(specs):
+    def decorator(view):
+        view.specs_dict = specs
+        return view
+
+    return decorator
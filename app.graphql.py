@@ -1,12 +1,18 @@
 import os
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
 from dotenv import load_dotenv
 
 # For working with GraphQL
 from ariadne import load_schema_from_path, make_executable_schema, graphql_sync
 from resolvers import query, mutation
+from profiler import init_profiler
+from maintenance import init_maintenance
+from idempotency import idempotent
+from deadlines import init_deadlines, deadline_passed, deadline_response
 from ariadne.explorer import ExplorerGraphiQL
+from graphql import GraphQLError, OperationType, get_operation_ast, parse
 
 load_dotenv()  # Take environment variables from .env.
 
@@ -20,9 +26,50 @@ schema = make_executable_schema(type_defs, [query, mutation])
 app = Flask(__name__)
 app.config["SECRET_KEY"] = os.environ.get("SECRET_KEY", "your_default_secret_key")
 
+# Maximum number of operations accepted in one batched POST
+app.config["GRAPHQL_MAX_BATCH_SIZE"] = int(os.getenv("GRAPHQL_MAX_BATCH_SIZE", 10))
+
+# Per-operation deadlines in seconds, keyed by operationName, e.g. {"Users": 2}
+app.config["GRAPHQL_OPERATION_DEADLINES"] = {}
+
 # Initialize CORS with default settings (allows all origins)
 CORS(app)
 
+# Admin-only on-demand sampling profiler
+init_profiler(app)
+
+# Background database maintenance (optimize, vacuum, WAL checkpoints)
+init_maintenance(app)
+
+# Per-request deadlines that abort SQLite statements once they pass
+init_deadlines(app)
+
+
+# Run one operation under its own deadline, capped by the request's deadline
+def execute_operation(operation, context):
+    # Cancel operations still queued when the request deadline has passed
+    if deadline_passed():
+        cancelled = {"data": None, "errors": [{"message": "Request deadline exceeded"}]}
+        return False, cancelled, True
+
+    operation_name = None
+    if isinstance(operation, dict):
+        operation_name = operation.get("operationName")
+    seconds = app.config["GRAPHQL_OPERATION_DEADLINES"].get(operation_name)
+
+    request_deadline = g.deadline
+    if seconds is not None:
+        g.deadline = min(request_deadline, time.monotonic() + seconds)
+    g.deadline_exceeded = False
+    try:
+        success, result = graphql_sync(
+            schema, operation, context_value=context, debug=True
+        )
+    finally:
+        timed_out = g.deadline_exceeded
+        g.deadline = request_deadline
+    return success, result, timed_out
+
 
 @app.route("/graphql", methods=["GET"])
 def graphql_playground():
@@ -30,7 +77,27 @@ def graphql_playground():
     return ExplorerGraphiQL().html(None)
 
 
+# Only requests containing a mutation are worth storing for idempotent replay
+def is_mutation_request():
+    data = request.get_json(silent=True)
+    for operation in data if isinstance(data, list) else [data]:
+        if not isinstance(operation, dict) or not isinstance(
+            operation.get("query"), str
+        ):
+            continue
+        try:
+            operation_ast = get_operation_ast(
+                parse(operation["query"]), operation.get("operationName")
+            )
+        except GraphQLError:
+            continue
+        if operation_ast and operation_ast.operation == OperationType.MUTATION:
+            return True
+    return False
+
+
 @app.route("/graphql", methods=["POST", "OPTIONS"])
+@idempotent(applies_to=is_mutation_request)
 def graphql_server():
     # Handle preflight OPTIONS request for CORS
     if request.method == "OPTIONS":
@@ -38,9 +105,39 @@ def graphql_server():
 
     # Handle POST request to the GraphQL server
     data = request.get_json()
-    success, result = graphql_sync(
-        schema, data, context_value={"request": request}, debug=True
-    )
+
+    # A JSON array is a batch of operations sharing one request context
+    is_batch = isinstance(data, list)
+    operations = data if is_batch else [data]
+    if is_batch:
+        max_batch_size = app.config["GRAPHQL_MAX_BATCH_SIZE"]
+        if not operations:
+            return jsonify({"error": "Batch must contain at least one operation"}), 400
+        if len(operations) > max_batch_size:
+            return (
+                jsonify({"error": f"Batch size exceeds limit of {max_batch_size}"}),
+                400,
+            )
+
+    # One connection per shard and one loader cache for every operation
+    context = {"request": request, "connections": {}, "loader_cache": {}}
+    try:
+        results = [execute_operation(operation, context) for operation in operations]
+    finally:
+        for conn in context["connections"].values():
+            conn.close()
+
+    timed_out = any(timed_out for _, _, timed_out in results)
+    if is_batch:
+        # Per-operation errors are reported inside each result
+        batch = [result for _, result, _ in results]
+        if timed_out:
+            return deadline_response(504, {"results": batch})
+        return jsonify(batch), 200
+
+    success, result, _ = results[0]
+    if timed_out:
+        return deadline_response(504, result)
     status_code = 200 if success else 400
     return jsonify(result), status_code
 
@@ -1,10 +1,14 @@
 import os
-from flask import Flask, request
+from flask import Flask
 from flask_cors import CORS
-from flasgger import Swagger  # Import Flasgger
 from dotenv import load_dotenv
 from auth import auth_bp
 from users import users_bp
+from profiler import init_profiler
+from maintenance import init_maintenance
+from deadlines import init_deadlines
+from validation import init_validation
+from docs import HostSwagger
 
 load_dotenv()  # take environment variables from .env.
 
@@ -16,8 +20,8 @@ app.config["SECRET_KEY"] = os.getenv(
 CORS(app)
 
 
-# Initialize Swagger with configuration
-swagger = Swagger(
+# Initialize Swagger with configuration; the spec is built lazily per host
+swagger = HostSwagger(
     app,
     config={
         "headers": [],
@@ -36,27 +40,22 @@ swagger = Swagger(
 )
 
 
-# Update Swagger configuration to set the host dynamically
-@app.before_request
-def set_swagger_host():
-    swagger.template = {
-        "swagger": "2.0",
-        "info": {
-            "title": "Python API",
-            "description": "API documentation for the user management system.",
-            "version": "1.0.0",
-        },
-        "host": request.host,  # Set the host from the current request
-        "basePath": "/",
-        "schemes": ["http", "https"],
-        "paths": {},  # Empty initially; filled by Flasgger
-    }
-
-
 # Register blueprints
 app.register_blueprint(auth_bp)
 app.register_blueprint(users_bp)
 
+# Admin-only on-demand sampling profiler
+init_profiler(app)
+
+# Background database maintenance (optimize, vacuum, WAL checkpoints)
+init_maintenance(app)
+
+# Per-request deadlines that abort SQLite statements once they pass
+init_deadlines(app)
+
+# Compile request-body validators from the @swag_from specs
+init_validation(app)
+
 
 # Run the Flask app when the script is executed directly
 # API deployed on render.com
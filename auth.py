@@ -1,20 +1,17 @@
 from flask import Blueprint, request, jsonify
 from werkzeug.security import generate_password_hash, check_password_hash
 from flasgger import swag_from
-from db import get_db_connection
+from sharding import allocate_id, connect_shard, is_email_taken, locate_email
+from deadlines import check_deadline
+from idempotency import idempotent, IDEMPOTENCY_KEY_PARAMETER
+from admin import SECRET_KEY
 import jwt
 import datetime
-import os
+import sqlite3
 
 # Create a Blueprint for authentication
 auth_bp = Blueprint("auth", __name__)
 
-SECRET_KEY = os.environ.get(
-    "SECRET_KEY", "1237ac0393917173029ad602d3152bd523ce383e9a89790b098fbf4c6a461ad8"
-)
-if not SECRET_KEY:
-    raise ValueError("No SECRET_KEY set for Flask application")
-
 
 # Route for user login (Authentication operation)
 @auth_bp.route("/login", methods=["POST"])
@@ -66,9 +63,11 @@ def login():
 
     print(email, password)
 
-    conn = get_db_connection()
-    user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
-    conn.close()
+    conn = connect_shard(locate_email(email))
+    try:
+        user = conn.execute("SELECT * FROM users WHERE email = ?", (email,)).fetchone()
+    finally:
+        conn.close()
 
     print(user)
     if user is None:
@@ -109,9 +108,11 @@ def login():
 
 # Route for user signup (Registration operation)
 @auth_bp.route("/signup", methods=["POST"])
+@idempotent
 @swag_from(
     {
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -145,26 +146,47 @@ def signup():
     password = data.get("password")
     avatar = data.get("avatar")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    slot = locate_email(email)
 
     # Check if the user already exists
-    existing_user = cursor.execute(
-        "SELECT * FROM users WHERE email = ?", (email,)
-    ).fetchone()
-    if existing_user:
+    conn = connect_shard(slot)
+    try:
+        existing_user = conn.execute(
+            "SELECT 1 FROM users WHERE email = ?", (email,)
+        ).fetchone()
+    finally:
         conn.close()
+    if existing_user:
         return jsonify({"error": "User already exists"}), 400
 
+    # Don't start hashing if the request has already run out of time; no
+    # connection is held while the password is hashed
+    check_deadline()
+
     # Hash the password for security
     hashed_password = generate_password_hash(password)
 
     # Insert the new user into the database
-    cursor.execute(
-        "INSERT INTO users (first_name, last_name, email, password, avatar) VALUES (?, ?, ?, ?, ?)",
-        (first_name, last_name, email, hashed_password, avatar),
-    )
-    conn.commit()
-    conn.close()
+    conn = connect_shard(slot)
+    try:
+        conn.execute(
+            "INSERT INTO users (id, first_name, last_name, email, password, avatar) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                allocate_id(conn, slot),
+                first_name,
+                last_name,
+                email,
+                hashed_password,
+                avatar,
+            ),
+        )
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        if not is_email_taken(e):
+            raise
+        # Created by a concurrent request while the password was being hashed
+        return jsonify({"error": "User already exists"}), 400
+    finally:
+        conn.close()
 
     return jsonify({"message": "User created successfully"}), 201
@@ -1,8 +1,16 @@
 import os
 import sqlite3
+from deadlines import get_remaining, install_deadline
 
-def get_db_connection():
-    db_path = os.path.join(os.getcwd(), 'database.db')
-    conn = sqlite3.connect(db_path)
+def get_db_path():
+    return os.path.join(os.getcwd(), 'database.db')
+
+def get_db_connection(db_path=None):
+    db_path = db_path or get_db_path()
+    # Don't wait on a locked database past the request deadline
+    remaining = get_remaining()
+    timeout = 5.0 if remaining is None else min(5.0, remaining)
+    conn = sqlite3.connect(db_path, timeout=timeout)
     conn.row_factory = sqlite3.Row
+    install_deadline(conn)
     return conn
@@ -0,0 +1,106 @@
+from flask import g, request, jsonify, current_app, has_request_context
+import os
+import sqlite3
+import time
+
+# Default time budget for a request, in seconds
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", 10))
+# SQLite virtual machine instructions between deadline checks
+PROGRESS_HANDLER_STEPS = int(os.getenv("PROGRESS_HANDLER_STEPS", 1000))
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Decorator that gives a route its own deadline (ROUTE_DEADLINES overrides it)
+def with_deadline(seconds):
+    def decorator(view):
+        view.request_deadline = seconds
+        return view
+
+    return decorator
+
+
+# Give the current request (or GraphQL operation) a deadline `seconds` from now
+def start_deadline(seconds):
+    now = time.monotonic()
+    g.deadline_started = g.get("deadline_started", now)
+    g.deadline = now + seconds
+    g.deadline_exceeded = False
+
+
+def deadline_passed():
+    deadline = g.get("deadline")
+    return deadline is not None and time.monotonic() >= deadline
+
+
+# Seconds left before the deadline, or None if there is no deadline
+def get_remaining():
+    deadline = g.get("deadline") if has_request_context() else None
+    if deadline is None:
+        return None
+    return max(0.0, deadline - time.monotonic())
+
+
+# Stop before starting expensive work (e.g. password hashing) past the deadline
+def check_deadline():
+    if has_request_context() and deadline_passed():
+        g.deadline_exceeded = True
+        raise DeadlineExceeded("Request deadline exceeded")
+
+
+# Abort statements running on this connection once the deadline passes
+def install_deadline(conn):
+    if not has_request_context() or g.get("deadline") is None:
+        return
+
+    def progress_handler():
+        if deadline_passed():
+            g.deadline_exceeded = True
+            return 1  # Non-zero makes SQLite interrupt the statement
+        return 0
+
+    conn.set_progress_handler(progress_handler, PROGRESS_HANDLER_STEPS)
+
+
+# JSON body with timing details for a request that ran out of time
+def deadline_response(status, body=None):
+    now = time.monotonic()
+    body = dict(body or {})
+    body.setdefault("error", "Request deadline exceeded")
+    body["timing"] = {
+        "elapsed_ms": round((now - g.deadline_started) * 1000, 3),
+        "deadline_ms": round((g.deadline - g.deadline_started) * 1000, 3),
+    }
+    return jsonify(body), status
+
+
+# Start each request's deadline and turn cancelled work into 503/504 responses
+def init_deadlines(app):
+    app.config.setdefault("ROUTE_DEADLINES", {})
+    app.before_request(start_request_deadline)
+    app.register_error_handler(DeadlineExceeded, handle_deadline_exceeded)
+    app.register_error_handler(sqlite3.OperationalError, handle_operational_error)
+
+
+def start_request_deadline():
+    seconds = current_app.config["ROUTE_DEADLINES"].get(request.endpoint)
+    if seconds is None:
+        view = current_app.view_functions.get(request.endpoint)
+        seconds = getattr(view, "request_deadline", REQUEST_DEADLINE)
+    start_deadline(seconds)
+
+
+def handle_deadline_exceeded(e):
+    return deadline_response(504)
+
+
+def handle_operational_error(e):
+    if g.get("deadline_exceeded"):
+        return deadline_response(504)
+    # The busy timeout is clipped to the deadline: no connection in time
+    if "locked" in str(e) and deadline_passed():
+        return deadline_response(503, {"error": "Database unavailable"})
+    current_app.logger.error(f"Database error: {e}")
+    return jsonify({"error": "Internal server error"}), 500
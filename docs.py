@@ -0,0 +1,39 @@
+import threading
+from flask import request
+from flasgger import Swagger
+
+
+# Swagger template for the API; the host is filled in per docs response
+def get_swagger_template():
+    return {
+        "swagger": "2.0",
+        "info": {
+            "title": "Python API",
+            "description": "API documentation for the user management system.",
+            "version": "1.0.0",
+        },
+        "host": None,  # Set per response from the current request
+        "basePath": "/",
+        "schemes": ["http", "https"],
+        "paths": {},  # Empty initially; filled by Flasgger
+    }
+
+
+class HostSwagger(Swagger):
+    # The spec is generated once, on first docs access; each response is a
+    # shallow copy with the request's host, so no per-host state is kept
+    def __init__(self, *args, **kwargs):
+        self.base_apispecs = {}
+        self.base_apispecs_lock = threading.Lock()
+        super().__init__(*args, **kwargs)
+
+    def get_apispecs(self, endpoint="apispec_1"):
+        spec = self.base_apispecs.get(endpoint)
+        if spec is None or self.app.debug:
+            with self.base_apispecs_lock:
+                spec = self.base_apispecs.get(endpoint)
+                if spec is None or self.app.debug:
+                    self.template = get_swagger_template()
+                    spec = super().get_apispecs(endpoint)
+                    self.base_apispecs[endpoint] = spec
+        return dict(spec, host=request.host)
@@ -0,0 +1,245 @@
+from flask import request, jsonify, make_response, Response
+from functools import wraps
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# How long a stored response can be replayed, and how many keys are kept
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", 24 * 60 * 60))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", 10000))
+# How long a duplicate waits for the first in-flight request to finish
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", 30))
+# How often a waiting duplicate checks whether the first request finished
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL", 0.05))
+# An in-flight claim older than this belongs to a worker that died mid-request
+IDEMPOTENCY_CLAIM_TIMEOUT = float(os.getenv("IDEMPOTENCY_CLAIM_TIMEOUT", 120))
+# Shared by every worker process, so a retry is replayed whichever one it hits
+IDEMPOTENCY_DB = os.getenv(
+    "IDEMPOTENCY_DB", os.path.join(os.getcwd(), "idempotency.db")
+)
+
+# Header documentation shared by the @swag_from specs of idempotent routes
+IDEMPOTENCY_KEY_PARAMETER = {
+    "name": "Idempotency-Key",
+    "in": "header",
+    "type": "string",
+    "required": False,
+    "description": "Retries with the same key replay the first response",
+}
+
+# One row per key. The row is inserted (status NULL) as the claim of the
+# request executing it and filled in with its response once that completes.
+IDEMPOTENCY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    key TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    claim TEXT NOT NULL,
+    claimed_at REAL NOT NULL,
+    status INTEGER,
+    body BLOB,
+    mimetype TEXT,
+    expires_at REAL
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_at
+    ON idempotency_keys (expires_at);
+"""
+
+
+class IdempotencyStore:
+    def __init__(self, db_path, ttl, max_keys, claim_timeout):
+        self.db_path = db_path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.claim_timeout = claim_timeout
+        self.initialized = False
+        self.init_lock = threading.Lock()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=5.0)
+        conn.row_factory = sqlite3.Row
+        if not self.initialized:
+            with self.init_lock:
+                if not self.initialized:
+                    conn.execute("PRAGMA journal_mode=WAL")
+                    conn.executescript(IDEMPOTENCY_SCHEMA)
+                    self.initialized = True
+        return conn
+
+    # An expired response, or the claim of a request that never finished
+    def is_stale(self, entry, now):
+        if entry["status"] is None:
+            return entry["claimed_at"] <= now - self.claim_timeout
+        return entry["expires_at"] <= now
+
+    # Return (claim, None) if the caller should execute the request itself,
+    # otherwise (None, entry) with the row of the request that owns the key
+    def begin(self, key, fingerprint):
+        conn = self.connect()
+        try:
+            while True:
+                now = time.time()
+                entry = conn.execute(
+                    "SELECT * FROM idempotency_keys WHERE key = ?", (key,)
+                ).fetchone()
+                if entry is not None and not self.is_stale(entry, now):
+                    return None, entry
+                if entry is not None:
+                    conn.execute(
+                        "DELETE FROM idempotency_keys WHERE key = ? AND claim = ?",
+                        (key, entry["claim"]),
+                    )
+
+                # Only one request (in any process) gets to insert the row
+                claim = uuid.uuid4().hex
+                inserted = conn.execute(
+                    """
+                    INSERT OR IGNORE INTO idempotency_keys
+                        (key, fingerprint, claim, claimed_at)
+                    VALUES (?, ?, ?, ?)
+                    """,
+                    (key, fingerprint, claim, now),
+                ).rowcount
+                conn.commit()
+                if inserted:
+                    return claim, None
+        finally:
+            conn.close()
+
+    def complete(self, key, claim, response):
+        conn = self.connect()
+        try:
+            # Server errors are not stored so the client can retry them
+            if response.status_code >= 500:
+                conn.execute(
+                    "DELETE FROM idempotency_keys WHERE key = ? AND claim = ?",
+                    (key, claim),
+                )
+            else:
+                conn.execute(
+                    """
+                    UPDATE idempotency_keys
+                    SET status = ?, body = ?, mimetype = ?, expires_at = ?
+                    WHERE key = ? AND claim = ?
+                    """,
+                    (
+                        response.status_code,
+                        response.get_data(),
+                        response.mimetype,
+                        time.time() + self.ttl,
+                        key,
+                        claim,
+                    ),
+                )
+            self.purge(conn)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def abandon(self, key, claim):
+        conn = self.connect()
+        try:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND claim = ?",
+                (key, claim),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    # Drop expired keys, then the soonest-expiring completed keys beyond
+    # max_keys. In-flight requests have no expires_at, so they are never evicted.
+    def purge(self, conn):
+        conn.execute(
+            "DELETE FROM idempotency_keys WHERE expires_at <= ?", (time.time(),)
+        )
+        conn.execute(
+            """
+            DELETE FROM idempotency_keys WHERE key IN (
+                SELECT key FROM idempotency_keys
+                WHERE expires_at IS NOT NULL
+                ORDER BY expires_at DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_keys,),
+        )
+
+
+idempotency_store = IdempotencyStore(
+    IDEMPOTENCY_DB, IDEMPOTENCY_TTL, IDEMPOTENCY_MAX_KEYS, IDEMPOTENCY_CLAIM_TIMEOUT
+)
+
+
+# Hash of everything that makes two requests "the same request"
+def get_request_fingerprint():
+    digest = hashlib.sha256()
+    digest.update(request.method.encode("utf-8"))
+    digest.update(request.path.encode("utf-8"))
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay_response(entry):
+    response = Response(
+        entry["body"], status=entry["status"], mimetype=entry["mimetype"]
+    )
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+# Decorator that replays the stored response for a repeated Idempotency-Key.
+# applies_to(), if given, limits it to requests worth storing.
+def idempotent(view=None, applies_to=None):
+    if view is None:
+        return lambda view: idempotent(view, applies_to)
+
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if not key or request.method != "POST":
+            return view(*args, **kwargs)
+        if applies_to is not None and not applies_to():
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({"error": "Idempotency-Key is too long"}), 400
+
+        fingerprint = get_request_fingerprint()
+        wait_until = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+        while True:
+            claim, entry = idempotency_store.begin(key, fingerprint)
+            if claim is not None:
+                break
+            if entry["fingerprint"] != fingerprint:
+                return (
+                    jsonify(
+                        {"error": "Idempotency-Key was used for a different request"}
+                    ),
+                    422,
+                )
+            if entry["status"] is not None:
+                return replay_response(entry)
+
+            # Wait for the first request with this key (possibly in another
+            # worker) instead of repeating its work. If it fails without
+            # storing a response, its row is gone and the next begin() claims it.
+            if time.monotonic() >= wait_until:
+                return (
+                    jsonify(
+                        {"error": "A request with this Idempotency-Key is in progress"}
+                    ),
+                    409,
+                )
+            time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+        try:
+            response = make_response(view(*args, **kwargs))
+        except Exception:
+            idempotency_store.abandon(key, claim)
+            raise
+        idempotency_store.complete(key, claim, response)
+        return response
+
+    return wrapper
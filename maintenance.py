@@ -0,0 +1,264 @@
+from flask import Blueprint, jsonify
+from admin import admin_required, swag_specs
+from sharding import get_shard_paths
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process coordination
+    fcntl = None
+
+# Create a Blueprint for reporting on background database maintenance
+maintenance_bp = Blueprint("maintenance", __name__)
+
+logger = logging.getLogger(__name__)
+
+# How often the scheduler wakes up to look at traffic and database size
+MAINTENANCE_INTERVAL = float(os.getenv("MAINTENANCE_INTERVAL", 60))
+# A check interval with fewer requests than this counts as a low-traffic window
+MAINTENANCE_IDLE_REQUESTS = int(os.getenv("MAINTENANCE_IDLE_REQUESTS", 5))
+# Thresholds that trigger work even while traffic is high
+MAINTENANCE_WAL_BYTES = int(os.getenv("MAINTENANCE_WAL_BYTES", 16 * 1024 * 1024))
+MAINTENANCE_FREE_PAGES = int(os.getenv("MAINTENANCE_FREE_PAGES", 1000))
+# Pages released per incremental vacuum step while traffic is high
+MAINTENANCE_VACUUM_PAGES = int(os.getenv("MAINTENANCE_VACUUM_PAGES", 200))
+
+
+class DatabaseMaintenance:
+    def __init__(self, db_path, interval):
+        self.db_path = db_path
+        self.interval = interval
+        self.requests = 0
+        self.last_report = None
+        # Only the process holding this lock maintains the file; all processes
+        # add their request counts to the traffic file so idleness is global
+        self.lock_path = f"{db_path}.maintenance.lock"
+        self.traffic_path = f"{db_path}.maintenance.traffic"
+        self.lock_file = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="db-maintenance", daemon=True
+        )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    # Called on every request; only a rough count is needed
+    def record_request(self):
+        self.requests += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            requests, self.requests = self.requests, 0
+            try:
+                is_leader = self.acquire_leadership()
+                requests = self.exchange_traffic(requests, is_leader)
+                if not is_leader:
+                    continue
+                self.last_report = self.run_once(
+                    idle=requests < MAINTENANCE_IDLE_REQUESTS
+                )
+                logger.info("Database maintenance: %s", self.last_report)
+            except Exception as e:
+                # Never let one bad run stop maintenance for good
+                logger.error(f"Database maintenance error: {e}")
+
+    # Try to become the one process that maintains this file; kept until exit
+    def acquire_leadership(self):
+        if fcntl is None or self.lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.lock_file = lock_file
+        return True
+
+    # Add this process's requests to the shared count; the leader takes the
+    # total (and resets it), everyone else gets their own count back
+    def exchange_traffic(self, requests, is_leader):
+        if fcntl is None:
+            return requests
+        with open(self.traffic_path, "a+") as traffic_file:
+            fcntl.flock(traffic_file, fcntl.LOCK_EX)
+            traffic_file.seek(0)
+            total = int(traffic_file.read().strip() or 0) + requests
+            traffic_file.seek(0)
+            traffic_file.truncate()
+            traffic_file.write("0" if is_leader else str(total))
+        return total if is_leader else requests
+
+    def get_stats(self, conn):
+        try:
+            wal_bytes = os.path.getsize(f"{self.db_path}-wal")
+        except OSError:
+            wal_bytes = 0  # No WAL (or it was removed by a checkpoint)
+        return {
+            "wal_bytes": wal_bytes,
+            "page_count": conn.execute("PRAGMA page_count").fetchone()[0],
+            "freelist_count": conn.execute("PRAGMA freelist_count").fetchone()[0],
+            "page_size": conn.execute("PRAGMA page_size").fetchone()[0],
+        }
+
+    # Decide which tasks are due, run them and report how long each took
+    def run_once(self, idle):
+        # A short busy timeout: maintenance gives way to request threads
+        conn = sqlite3.connect(self.db_path, timeout=0.1)
+        try:
+            before = self.get_stats(conn)
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            auto_vacuum = conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+            if journal_mode != "wal":
+                # WAL persists in the file, so databases created before
+                # setup_db.py enabled it switch over on their first pass
+                try:
+                    journal_mode = conn.execute(
+                        "PRAGMA journal_mode = WAL"
+                    ).fetchone()[0]
+                except sqlite3.OperationalError:
+                    pass  # Another connection holds the file; next pass
+            if auto_vacuum == 0 and self.last_report is None:
+                logger.warning(
+                    "%s has auto_vacuum=NONE, so free pages are never released; "
+                    "run python maintenance.py migrate once",
+                    self.db_path,
+                )
+
+            tasks = []
+            if idle:
+                tasks.append(("optimize", "PRAGMA optimize"))
+            # Incremental vacuum only works with auto_vacuum=INCREMENTAL (2)
+            if auto_vacuum == 2 and (
+                idle or before["freelist_count"] >= MAINTENANCE_FREE_PAGES
+            ):
+                pages = "" if idle else f"({MAINTENANCE_VACUUM_PAGES})"
+                tasks.append(
+                    ("incremental_vacuum", f"PRAGMA incremental_vacuum{pages}")
+                )
+            if journal_mode == "wal":
+                # TRUNCATE waits for readers, so it only runs when traffic is low
+                if idle:
+                    tasks.append(("checkpoint", "PRAGMA wal_checkpoint(TRUNCATE)"))
+                elif before["wal_bytes"] >= MAINTENANCE_WAL_BYTES:
+                    tasks.append(("checkpoint", "PRAGMA wal_checkpoint(PASSIVE)"))
+
+            timings = {}
+            for name, statement in tasks:
+                started = time.perf_counter()
+                # executescript steps each statement to completion; execute()
+                # would stop incremental_vacuum after freeing a single page
+                conn.executescript(statement)
+                timings[name] = round((time.perf_counter() - started) * 1000, 3)
+
+            return {
+                "idle": idle,
+                "journal_mode": journal_mode,
+                "auto_vacuum": AUTO_VACUUM_MODES.get(auto_vacuum, auto_vacuum),
+                "before": before,
+                "after": self.get_stats(conn),
+                "task_ms": timings,
+                "finished_at": time.time(),
+            }
+        finally:
+            conn.close()
+
+
+# Names of the PRAGMA auto_vacuum values
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+
+# Put a database file in the modes maintenance relies on; both persist in the
+# file. auto_vacuum only takes effect once VACUUM rebuilds the file, which
+# locks it for the whole rewrite, so this is a one-time step run while the
+# app is stopped: python maintenance.py migrate
+def migrate_database(db_path):
+    conn = sqlite3.connect(db_path)
+    try:
+        changes = {}
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+            changes["auto_vacuum"] = "incremental"
+        if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+            conn.execute("PRAGMA journal_mode = WAL")
+            changes["journal_mode"] = "wal"
+        return changes
+    finally:
+        conn.close()
+
+
+# The schedulers started by init_maintenance, one per shard file in every
+# process; only the lock holder of each file actually runs maintenance
+schedulers = []
+
+
+# Start the schedulers alongside an application and count its requests
+def init_maintenance(app):
+    if not schedulers:
+        for db_path in get_shard_paths():
+            scheduler = DatabaseMaintenance(db_path, MAINTENANCE_INTERVAL)
+            scheduler.start()
+            schedulers.append(scheduler)
+
+    app.register_blueprint(maintenance_bp)
+    app.before_request(record_request)
+
+
+def record_request():
+    for scheduler in schedulers:
+        scheduler.record_request()
+
+
+# Route to get the report of the last maintenance run
+@maintenance_bp.route("/admin/maintenance", methods=["GET"])
+@admin_required
+@swag_specs(
+    {
+        "parameters": [
+            {
+                "name": "Authorization",
+                "in": "header",
+                "type": "string",
+                "required": True,
+                "description": "Bearer token of an admin user",
+            }
+        ],
+        "responses": {
+            200: {"description": "Last maintenance report of each shard file"},
+            404: {"description": "Maintenance has not run yet"},
+        },
+    }
+)
+def maintenance_report():
+    reports = {
+        os.path.basename(scheduler.db_path): scheduler.last_report
+        for scheduler in schedulers
+        if scheduler.last_report is not None
+    }
+    if not reports:
+        return (
+            jsonify({"error": "Maintenance has not run yet in this process"}),
+            404,
+        )
+    return jsonify(reports), 200
+
+
+# Migrate every shard file from the command line: python maintenance.py migrate
+if __name__ == "__main__":
+    if sys.argv[1:] != ["migrate"]:
+        print("Usage: python maintenance.py migrate")
+        sys.exit(1)
+    for db_path in get_shard_paths():
+        changes = migrate_database(db_path)
+        print(f"{db_path}: {changes or 'already migrated'}")
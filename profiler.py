@@ -0,0 +1,291 @@
+from flask import Blueprint, request, jsonify, current_app
+from collections import Counter
+from admin import admin_required, swag_specs
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+
+# Create a Blueprint for the on-demand profiler control surface
+profiler_bp = Blueprint("profiler", __name__)
+
+# The running profiling session, or None when the profiler is disabled
+_session = None
+_session_lock = threading.Lock()
+
+
+class ProfilingSession:
+    def __init__(self, duration, route, percentage, interval, output_dir):
+        self.route = route
+        self.percentage = percentage
+        self.interval = interval
+        self.output_dir = output_dir
+        self.started_at = time.time()
+        self.deadline = self.started_at + duration
+        self.stacks = Counter()
+        self.sampled_requests = 0
+        self.output_path = None
+        # Thread ids of the requests currently being sampled
+        self.threads = set()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.sampler = threading.Thread(target=self.run, daemon=True)
+
+    # Should this request be sampled?
+    def matches(self, rule):
+        if self.route is not None and rule != self.route:
+            return False
+        return random.random() * 100 < self.percentage
+
+    # Periodically record the stacks of the threads serving sampled requests
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            if time.time() >= self.deadline:
+                break
+            with self.lock:
+                threads = list(self.threads)
+            if not threads:
+                continue
+
+            frames = sys._current_frames()
+            for thread_id in threads:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[collapse_stack(frame)] += 1
+
+        finish_session(self)
+
+    # Write the samples in collapsed-stack format ("frame;frame;frame count")
+    def write_output(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        path = os.path.join(
+            self.output_dir, f"profile-{timestamp}-{os.getpid()}.folded"
+        )
+        with open(path, "w") as output:
+            for stack, count in self.stacks.most_common():
+                output.write(f"{stack} {count}\n")
+        self.output_path = path
+        return path
+
+    def status(self):
+        return {
+            "active": not self.stop_event.is_set(),
+            "route": self.route,
+            "percentage": self.percentage,
+            "interval_ms": self.interval * 1000,
+            "remaining_seconds": max(0.0, round(self.deadline - time.time(), 3)),
+            "sampled_requests": self.sampled_requests,
+            "samples": sum(self.stacks.values()),
+            "output": self.output_path,
+        }
+
+
+# Render a frame and its callers as one root-first flamegraph line
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+# Called by the sampler thread on exit: disable the profiler and flush samples
+def finish_session(session):
+    global _session
+    with _session_lock:
+        if _session is session:
+            _session = None
+    session.stop_event.set()
+    session.write_output()
+
+
+# Register the control routes and request hooks on an application
+def init_profiler(app):
+    app.config.setdefault(
+        "PROFILER_OUTPUT_DIR", os.getenv("PROFILER_OUTPUT_DIR", "profiles")
+    )
+    app.register_blueprint(profiler_bp)
+    app.before_request(start_request_sampling)
+    app.teardown_request(stop_request_sampling)
+
+
+def start_request_sampling():
+    session = _session
+    # No session means the profiler is disabled: return before doing anything
+    if session is None:
+        return None
+
+    rule = request.url_rule.rule if request.url_rule else request.path
+    if session.matches(rule):
+        with session.lock:
+            session.threads.add(threading.get_ident())
+            session.sampled_requests += 1
+    return None
+
+
+def stop_request_sampling(exception=None):
+    session = _session
+    if session is None:
+        return
+    with session.lock:
+        session.threads.discard(threading.get_ident())
+
+
+# Numeric start options: (default, minimum, maximum); values are clamped
+PROFILER_LIMITS = {
+    "duration": (30, 1, 600),
+    "percentage": (100, 0, 100),
+    "interval_ms": (5, 1, 1000),
+}
+
+
+# Check the start options and clamp them into range; returns (options, error)
+def parse_profiler_options(body):
+    if body is None:
+        body = {}
+    if not isinstance(body, dict):
+        return None, "Body must be a JSON object"
+
+    options = {}
+    for name, (default, minimum, maximum) in PROFILER_LIMITS.items():
+        value = body.get(name, default)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None, f"{name} must be a number"
+        options[name] = min(max(value, minimum), maximum)
+
+    route = body.get("route")
+    if route is not None and not isinstance(route, str):
+        return None, "route must be a string"
+    options["route"] = route
+    return options, None
+
+
+# Route to start a profiling session
+@profiler_bp.route("/admin/profiler/start", methods=["POST"])
+@admin_required
+@swag_specs(
+    {
+        "parameters": [
+            {
+                "name": "Authorization",
+                "in": "header",
+                "type": "string",
+                "required": True,
+                "description": "Bearer token of an admin user",
+            },
+            {
+                "name": "body",
+                "in": "body",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "duration": {
+                            "type": "number",
+                            "description": "Clamped to 1-600",
+                            "example": 30,
+                        },
+                        "route": {"type": "string", "example": "/users/<user_id>"},
+                        "percentage": {
+                            "type": "number",
+                            "description": "Clamped to 0-100",
+                            "example": 100,
+                        },
+                        "interval_ms": {
+                            "type": "number",
+                            "description": "Clamped to 1-1000",
+                            "example": 5,
+                        },
+                    },
+                },
+            },
+        ],
+        "responses": {
+            200: {"description": "Profiler started"},
+            409: {"description": "Profiler already running"},
+        },
+    }
+)
+def start_profiler():
+    global _session
+    # Validated here (not by the schema above) so both apps clamp the same way
+    options, error = parse_profiler_options(request.get_json(silent=True))
+    if error:
+        return jsonify({"error": error}), 400
+
+    with _session_lock:
+        if _session is not None:
+            return jsonify({"error": "Profiler already running"}), 409
+
+        session = ProfilingSession(
+            duration=options["duration"],
+            route=options["route"],
+            percentage=options["percentage"],
+            interval=options["interval_ms"] / 1000,
+            output_dir=current_app.config["PROFILER_OUTPUT_DIR"],
+        )
+        _session = session
+        session.sampler.start()
+
+    return (
+        jsonify({"message": "Profiler started", "profiler": session.status()}),
+        200,
+    )
+
+
+# Route to stop the running profiling session and write its output
+@profiler_bp.route("/admin/profiler/stop", methods=["POST"])
+@admin_required
+@swag_specs(
+    {
+        "parameters": [
+            {
+                "name": "Authorization",
+                "in": "header",
+                "type": "string",
+                "required": True,
+                "description": "Bearer token of an admin user",
+            }
+        ],
+        "responses": {
+            200: {"description": "Profiler stopped"},
+            404: {"description": "Profiler not running"},
+        },
+    }
+)
+def stop_profiler():
+    session = _session
+    if session is None:
+        return jsonify({"error": "Profiler not running"}), 404
+
+    # The sampler thread writes the output as it exits
+    session.stop_event.set()
+    session.sampler.join()
+    return jsonify({"message": "Profiler stopped", "profiler": session.status()}), 200
+
+
+# Route to inspect the running profiling session
+@profiler_bp.route("/admin/profiler", methods=["GET"])
+@admin_required
+@swag_specs(
+    {
+        "parameters": [
+            {
+                "name": "Authorization",
+                "in": "header",
+                "type": "string",
+                "required": True,
+                "description": "Bearer token of an admin user",
+            }
+        ],
+        "responses": {200: {"description": "Profiler status"}},
+    }
+)
+def profiler_status():
+    session = _session
+    if session is None:
+        return jsonify({"active": False}), 200
+    return jsonify(session.status()), 200
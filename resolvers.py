@@ -1,34 +1,75 @@
 from ariadne import QueryType, MutationType
 from werkzeug.security import generate_password_hash
-from db import get_db_connection
+from sharding import (
+    allocate_id,
+    delete_user_row,
+    fetch_all,
+    get_cached_connection,
+    is_email_taken,
+    locate_email,
+    locate_id,
+    update_user_row,
+)
+import sqlite3
+from deadlines import check_deadline
 
 query = QueryType()
 mutation = MutationType()
 
+
+# Per-request {shard slot: connection} cache, shared by every operation in a batch.
+# graphql_server passes a dict context and closes these connections afterwards.
+def get_connections(info):
+    if not isinstance(info.context, dict):
+        raise TypeError("Resolvers require the dict context built by graphql_server")
+    return info.context.setdefault("connections", {})
+
+
+# Use the request's shared connection to a shard
+def get_connection(info, slot):
+    return get_cached_connection(get_connections(info), slot)
+
+
+# Per-request cache of user rows, shared by every operation in a batch
+def get_loader_cache(info):
+    if not isinstance(info.context, dict):
+        return {}
+    return info.context.setdefault("loader_cache", {})
+
+
 # Query Resolvers
 
 
 @query.field("users")
-def resolve_users(*_):
-    conn = get_db_connection()
-    users = conn.execute(
-        "SELECT id, first_name, last_name, email, role, avatar FROM users"
-    ).fetchall()
-    conn.close()
-    return [dict(user) for user in users]
+def resolve_users(_, info):
+    # Fanned out to every shard and merged by id
+    users = fetch_all(
+        "SELECT id, first_name, last_name, email, role, avatar FROM users ORDER BY id",
+        connections=get_connections(info),
+    )
+    users = [dict(user) for user in users]
+
+    # Prime the loader cache so later user(user_id) lookups skip the DB
+    cache = get_loader_cache(info)
+    for user in users:
+        cache[str(user["id"])] = user
+    return users
 
 
 @query.field("user")
-def resolve_user(*_, user_id):
-    conn = get_db_connection()
+def resolve_user(_, info, user_id):
+    cache = get_loader_cache(info)
+    if str(user_id) in cache:
+        return cache[str(user_id)]
+
+    conn = get_connection(info, locate_id(user_id))
     user = conn.execute(
         "SELECT id, first_name, last_name, email, role, avatar FROM users WHERE id = ?",
         (user_id,),
     ).fetchone()
-    conn.close()
-    if user is None:
-        return None
-    return dict(user)
+    user = dict(user) if user is not None else None
+    cache[str(user_id)] = user
+    return user
 
 
 # Mutation Resolvers
@@ -36,9 +77,10 @@ def resolve_user(*_, user_id):
 
 @mutation.field("createUser")
 def resolve_create_user(
-    *_, first_name, last_name, email, password, role=None, avatar=None
+    _, info, first_name, last_name, email, password, role=None, avatar=None
 ):
-    conn = get_db_connection()
+    slot = locate_email(email)
+    conn = get_connection(info, slot)
     cursor = conn.cursor()
 
     # Check if the user already exists
@@ -46,22 +88,39 @@ def resolve_create_user(
         "SELECT * FROM users WHERE email = ?", (email,)
     ).fetchone()
     if existing_user:
-        conn.close()
         raise Exception("User already exists")
 
+    # Don't start hashing if the operation has already run out of time
+    check_deadline()
+
     # Hash the password before saving it
     hashed_password = generate_password_hash(password)
 
-    # Insert the new user into the database
-    cursor.execute(
-        "INSERT INTO users (first_name, last_name, email, password, role, avatar) VALUES (?, ?, ?, ?, ?, ?)",
-        (first_name, last_name, email, hashed_password, role, avatar),
-    )
-    conn.commit()
+    # Insert the new user into the database. The connection is shared by the
+    # whole batch, so a failed insert must not leave its write lock behind.
+    try:
+        cursor.execute(
+            "INSERT INTO users (id, first_name, last_name, email, password, role, avatar) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                allocate_id(conn, slot),
+                first_name,
+                last_name,
+                email,
+                hashed_password,
+                role,
+                avatar,
+            ),
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        if isinstance(e, sqlite3.IntegrityError) and is_email_taken(e):
+            raise Exception("User already exists")
+        raise
 
     # Get the auto-generated user ID
     user_id = cursor.lastrowid
-    conn.close()
+    get_loader_cache(info).pop(str(user_id), None)
 
     return {
         "id": user_id,
@@ -75,7 +134,8 @@ def resolve_create_user(
 
 @mutation.field("updateUser")
 def resolve_update_user(
-    *_,
+    _,
+    info,
     user_id,
     first_name=None,
     last_name=None,
@@ -84,54 +144,51 @@ def resolve_update_user(
     password=None,
     avatar=None
 ):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Hash the password if it was provided
+    # Hash the password if it was provided (and there is still time)
+    if password:
+        check_deadline()
     hashed_password = generate_password_hash(password) if password else None
 
-    # Update the user in the database
-    cursor.execute(
-        """
-        UPDATE users
-        SET first_name = COALESCE(?, first_name),
-            last_name = COALESCE(?, last_name),
-            email = COALESCE(?, email),
-            role = COALESCE(?, role),
-            password = COALESCE(?, password),
-            avatar = COALESCE(?, avatar)
-        WHERE id = ?
-        """,
-        (first_name, last_name, email, role, hashed_password, avatar, user_id),
-    )
-    conn.commit()
+    # Update only the provided fields; moves the user too when the new email
+    # hashes to a different shard
+    changes = {
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": email,
+        "role": role,
+        "password": hashed_password,
+        "avatar": avatar,
+    }
+    try:
+        slot = update_user_row(
+            user_id,
+            {column: value for column, value in changes.items() if value is not None},
+        )
+    except sqlite3.IntegrityError as e:
+        if not is_email_taken(e):
+            raise
+        raise Exception("User already exists")
+    get_loader_cache(info).pop(str(user_id), None)
 
-    if cursor.rowcount == 0:
-        conn.close()
+    if slot is None:
         raise Exception("User not found")
 
     # Fetch the updated user details
-    updated_user = cursor.execute(
+    updated_user = get_connection(info, slot).execute(
         "SELECT id, first_name, last_name, email, role, avatar FROM users WHERE id = ?",
         (user_id,),
     ).fetchone()
-    conn.close()
 
     return dict(updated_user)
 
 
 @mutation.field("deleteUser")
-def resolve_delete_user(*_, user_id):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    # Delete the user from the database
-    cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-    conn.commit()
+def resolve_delete_user(_, info, user_id):
+    # Delete the user from whichever shard holds it
+    deleted = delete_user_row(user_id)
+    get_loader_cache(info).pop(str(user_id), None)
 
-    if cursor.rowcount == 0:
-        conn.close()
+    if not deleted:
         raise Exception("User not found")
 
-    conn.close()
     return "User deleted successfully"
@@ -14,6 +14,12 @@ conn = get_db_connection()
 # Create a cursor object using the cursor() method
 cursor = conn.cursor()
 
+# Must be set before the first table is created to take effect; lets the
+# maintenance scheduler reclaim free pages with incremental vacuum
+cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+# Write-ahead logging so readers don't block the writer
+cursor.execute("PRAGMA journal_mode = WAL")
+
 # Create the users table if it doesn't exist
 cursor.execute(
     """
@@ -0,0 +1,402 @@
+import hashlib
+import heapq
+import os
+import sys
+import sqlite3
+import threading
+from db import get_db_connection, get_db_path
+
+# Shard database files, comma-separated. Append new shards at the end and
+# never reorder: a shard's position (its slot) is baked into the ids it issues.
+DB_SHARDS = [
+    path.strip() for path in os.getenv("DB_SHARDS", "").split(",") if path.strip()
+]
+# Ids created on slot N start at N << SHARD_ID_BITS, so slot 0 keeps the
+# legacy ids and an id alone tells which shard it was created on
+SHARD_ID_BITS = 40
+# Columns a user row is copied with when it moves between shards
+USER_COLUMNS = ("id", "first_name", "last_name", "email", "password", "role", "avatar")
+
+# While users are being moved, email lookups also probe lower-ranked shards
+rebalancing = os.getenv("DB_SHARDS_REBALANCING") == "1"
+
+# Slots whose schema has been checked by this process
+_initialized_slots = set()
+_init_lock = threading.Lock()
+
+USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    role TEXT NOT NULL DEFAULT 'user',
+    avatar TEXT
+)
+"""
+
+# Where users created on this shard (their id's slot) have been moved to
+MOVED_USERS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS moved_users (
+    id INTEGER PRIMARY KEY,
+    shard INTEGER NOT NULL
+)
+"""
+
+# Last id issued from this shard's range. AUTOINCREMENT can't be used for that:
+# SQLite takes max(seq, max(id)) + 1, and rows moved in from higher shards
+# would push it into their range.
+ID_SEQUENCE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS id_sequence (
+    last_id INTEGER NOT NULL
+)
+"""
+
+
+def get_shard_paths():
+    if not DB_SHARDS:
+        return [get_db_path()]
+    return [os.path.join(os.getcwd(), path) for path in DB_SHARDS]
+
+
+def get_shard_count():
+    return len(get_shard_paths())
+
+
+def get_id_range(slot):
+    return slot << SHARD_ID_BITS, ((slot + 1) << SHARD_ID_BITS) - 1
+
+
+# Make sure a shard has the users table and its own id range
+def init_shard(conn, slot):
+    low, high = get_id_range(slot)
+    # Same file settings as setup_db.py. auto_vacuum must come before the first
+    # table (existing files: python maintenance.py migrate); WAL persists.
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+    except sqlite3.OperationalError:
+        pass  # Busy; the maintenance scheduler switches it over later
+    conn.execute(USERS_SCHEMA)
+    conn.execute(MOVED_USERS_SCHEMA)
+    conn.execute(ID_SEQUENCE_SCHEMA)
+    # Continue after the highest id this shard has issued (legacy rows included)
+    conn.execute(
+        """
+        INSERT INTO id_sequence (last_id)
+        SELECT MAX(
+            ?,
+            COALESCE((SELECT MAX(id) FROM users WHERE id BETWEEN ? AND ?), 0),
+            COALESCE((SELECT seq FROM sqlite_sequence
+                      WHERE name = 'users' AND seq BETWEEN ? AND ?), 0)
+        )
+        WHERE NOT EXISTS (SELECT 1 FROM id_sequence)
+        """,
+        (low, low, high, low, high),
+    )
+    conn.commit()
+
+
+# Reserve the next id of the shard's range for an insert on conn; commit it
+# with the insert. None when not sharded, so AUTOINCREMENT assigns the id.
+def allocate_id(conn, slot):
+    if not DB_SHARDS:
+        return None
+    conn.execute("UPDATE id_sequence SET last_id = last_id + 1")
+    return conn.execute("SELECT last_id FROM id_sequence").fetchone()[0]
+
+
+def connect_shard(slot):
+    conn = get_db_connection(get_shard_paths()[slot])
+    # A single unsharded database.db is used exactly as before
+    if DB_SHARDS and slot not in _initialized_slots:
+        with _init_lock:
+            if slot not in _initialized_slots:
+                init_shard(conn, slot)
+                _initialized_slots.add(slot)
+    return conn
+
+
+# Reuse a connection from a per-request {slot: connection} cache
+def get_cached_connection(connections, slot):
+    if slot not in connections:
+        connections[slot] = connect_shard(slot)
+    return connections[slot]
+
+
+# Shards ordered by rendezvous hash of the email: the first one owns the user.
+# Adding a shard only moves the users for which the new shard ranks first.
+# Shards are named by their DB_SHARDS entry exactly as configured, so two
+# files with the same name in different directories stay distinct; changing
+# an entry's spelling reassigns users like adding a new shard would.
+def rank_shards(email):
+    key = (email or "").strip().lower()
+    scores = []
+    for slot, name in enumerate(DB_SHARDS or ["database.db"]):
+        digest = hashlib.sha256(f"{name}:{key}".encode("utf-8"))
+        scores.append((int.from_bytes(digest.digest()[:8], "big"), slot))
+    return [slot for _, slot in sorted(scores, reverse=True)]
+
+
+def get_slot_for_email(email):
+    return rank_shards(email)[0]
+
+
+# Shard holding the user with this email (or where a new one should be created)
+def locate_email(email):
+    ranked = rank_shards(email)
+    if not rebalancing or len(ranked) == 1:
+        return ranked[0]
+
+    # Users not moved yet still live on the shard that owned them before
+    for slot in ranked:
+        conn = connect_shard(slot)
+        try:
+            found = conn.execute(
+                "SELECT 1 FROM users WHERE email = ?", (email,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if found:
+            return slot
+    return ranked[0]
+
+
+# Shard the id was created on
+def get_origin_slot(user_id):
+    try:
+        slot = int(user_id) >> SHARD_ID_BITS
+    except (TypeError, ValueError):
+        return 0
+    return slot if 0 <= slot < get_shard_count() else 0
+
+
+# Shard holding the user with this id: its origin shard, unless it was moved
+def locate_id(user_id):
+    slot = get_origin_slot(user_id)
+    if get_shard_count() == 1:
+        return slot
+
+    conn = connect_shard(slot)
+    try:
+        moved = conn.execute(
+            "SELECT shard FROM moved_users WHERE id = ?", (user_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return moved["shard"] if moved else slot
+
+
+# Drop the origin shard's redirect for a user that no longer lives elsewhere
+def clear_redirect(user_id, slot):
+    origin = get_origin_slot(user_id)
+    if origin == slot:
+        return
+    conn = connect_shard(origin)
+    try:
+        conn.execute("DELETE FROM moved_users WHERE id = ?", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+# Run a read on every shard and merge the rows (by id when the rows have one,
+# which requires the query to be ORDER BY id)
+def fetch_all(sql, params=(), connections=None):
+    results = []
+    for slot in range(get_shard_count()):
+        if connections is None:
+            conn = connect_shard(slot)
+            try:
+                results.append(conn.execute(sql, params).fetchall())
+            finally:
+                conn.close()
+        else:
+            conn = get_cached_connection(connections, slot)
+            results.append(conn.execute(sql, params).fetchall())
+
+    if len(results) == 1:
+        return results[0]
+    first = next((rows[0] for rows in results if rows), None)
+    if first is not None and "id" in first.keys():
+        # A user being moved is on both shards for a moment; list it once
+        merged = []
+        for row in heapq.merge(*results, key=lambda row: row["id"]):
+            if not merged or merged[-1]["id"] != row["id"]:
+                merged.append(row)
+        return merged
+    return [row for rows in results for row in rows]
+
+
+# Copy a user (with any column changes) to another shard, point its origin at
+# the new home, then delete it. The source's write lock is held throughout, so
+# the row can't change between the copy and the delete; writes that waited on
+# it find the row gone and re-locate the user. Raises sqlite3.IntegrityError
+# (nothing moved) when the target already has the email.
+def move_user(user_id, from_slot, to_slot, changes=None):
+    origin = get_origin_slot(user_id)
+    source = connect_shard(from_slot)
+    target = connect_shard(to_slot)
+    try:
+        source.execute("BEGIN IMMEDIATE")
+        row = source.execute(
+            f"SELECT {', '.join(USER_COLUMNS)} FROM users WHERE id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            source.rollback()
+            return False
+
+        values = dict(row, **(changes or {}))
+        try:
+            target.execute(
+                f"INSERT INTO users ({', '.join(USER_COLUMNS)}) "
+                f"VALUES ({', '.join('?' for _ in USER_COLUMNS)})",
+                tuple(values[column] for column in USER_COLUMNS),
+            )
+            if origin == to_slot:
+                target.execute("DELETE FROM moved_users WHERE id = ?", (user_id,))
+            target.commit()
+        except sqlite3.Error:
+            target.rollback()
+            source.rollback()
+            raise
+
+        if origin not in (from_slot, to_slot):
+            origin_conn = connect_shard(origin)
+            try:
+                set_redirect(origin_conn, user_id, to_slot)
+                origin_conn.commit()
+            finally:
+                origin_conn.close()
+        elif origin == from_slot:
+            set_redirect(source, user_id, to_slot)
+
+        source.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        source.commit()
+        return True
+    finally:
+        source.close()
+        target.close()
+
+
+# Whether an IntegrityError is the users.email UNIQUE constraint
+def is_email_taken(error):
+    return "users.email" in str(error)
+
+
+def set_redirect(conn, user_id, slot):
+    conn.execute(
+        "INSERT OR REPLACE INTO moved_users (id, shard) VALUES (?, ?)",
+        (user_id, slot),
+    )
+
+
+# Update a user's columns, moving it in the same step when a new email hashes
+# to another shard. Returns the shard now holding the user (None if there is
+# no such user); raises sqlite3.IntegrityError when the email is taken.
+def update_user_row(user_id, changes):
+    email = changes.get("email")
+    if email is not None:
+        # The email's owner may live on any shard, not just the user's own
+        conn = connect_shard(locate_email(email))
+        try:
+            taken = conn.execute(
+                "SELECT 1 FROM users WHERE email = ? AND id != ?", (email, user_id)
+            ).fetchone()
+        finally:
+            conn.close()
+        if taken:
+            # Same error as a conflict caught by the shard's own UNIQUE index
+            raise sqlite3.IntegrityError("UNIQUE constraint failed: users.email")
+
+    # A second try covers a user moved away while this write was waiting
+    for _ in range(2):
+        slot = locate_id(user_id)
+        target = slot if email is None else get_slot_for_email(email)
+        if target != slot:
+            if move_user(user_id, slot, target, changes):
+                return target
+            continue
+
+        conn = connect_shard(slot)
+        try:
+            if changes:
+                assignments = ", ".join(f"{column} = ?" for column in changes)
+                found = conn.execute(
+                    f"UPDATE users SET {assignments} WHERE id = ?",
+                    (*changes.values(), user_id),
+                ).rowcount
+                conn.commit()
+            else:
+                found = conn.execute(
+                    "SELECT 1 FROM users WHERE id = ?", (user_id,)
+                ).fetchone()
+        finally:
+            conn.close()
+        if found:
+            return slot
+    return None
+
+
+# Delete a user wherever it lives; False if there is no such user
+def delete_user_row(user_id):
+    for _ in range(2):
+        slot = locate_id(user_id)
+        conn = connect_shard(slot)
+        try:
+            deleted = conn.execute(
+                "DELETE FROM users WHERE id = ?", (user_id,)
+            ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        if deleted:
+            clear_redirect(user_id, slot)
+            return True
+    return False
+
+
+# Move every user whose email hashes to another shard, in small batches so the
+# shards stay online; run after appending new paths to DB_SHARDS
+def rebalance(batch_size=100):
+    global rebalancing
+    rebalancing = True
+    moved = 0
+    try:
+        for slot in range(get_shard_count()):
+            last_id = -1
+            while True:
+                conn = connect_shard(slot)
+                try:
+                    users = conn.execute(
+                        "SELECT id, email FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                        (last_id, batch_size),
+                    ).fetchall()
+                finally:
+                    conn.close()
+                if not users:
+                    break
+
+                for user in users:
+                    target = get_slot_for_email(user["email"])
+                    if target == slot:
+                        continue
+                    try:
+                        if move_user(user["id"], slot, target):
+                            moved += 1
+                    except sqlite3.IntegrityError as e:
+                        # Left in place; needs a manual look (e.g. a duplicate email)
+                        print(f"Could not move user {user['id']}: {e}", file=sys.stderr)
+                last_id = users[-1]["id"]
+    finally:
+        rebalancing = os.getenv("DB_SHARDS_REBALANCING") == "1"
+    return moved
+
+
+# Rebalance from the command line: python sharding.py rebalance
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebalance"]:
+        print("Usage: python sharding.py rebalance")
+        sys.exit(1)
+    print(f"Moved {rebalance()} users across {get_shard_count()} shards.")
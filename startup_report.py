@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+import time
+
+# Entry points to measure and how many of the slowest imports to show
+ENTRY_POINTS = ["app.py", "app.graphql.py"]
+TOP_IMPORTS = int(os.getenv("STARTUP_REPORT_TOP", 15))
+
+
+# Import an entry point in a fresh interpreter with -X importtime
+def measure_startup(entry_point):
+    code = f"import runpy; runpy.run_path({entry_point!r})"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"{entry_point} failed to start:\n{result.stderr}")
+
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((int(cumulative_us), int(self_us), name.rstrip()))
+    return elapsed, imports
+
+
+def print_report(entry_point, elapsed, imports):
+    # Only top-level imports (no leading spaces) add up to the total import time
+    top_level = [item for item in imports if not item[2].startswith("  ")]
+    import_total = sum(cumulative for cumulative, _, _ in top_level) / 1e6
+
+    print(f"== {entry_point} ==")
+    print(f"process wall time: {elapsed * 1000:8.1f} ms")
+    print(f"total import time: {import_total * 1000:8.1f} ms")
+    # Interpreter boot plus module-level work such as Swagger and schema setup
+    print(f"everything else:   {(elapsed - import_total) * 1000:8.1f} ms")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for cumulative, self_us, name in sorted(imports, reverse=True)[:TOP_IMPORTS]:
+        print(f"{cumulative / 1000:14.1f} {self_us / 1000:8.1f}  {name.strip()}")
+    print()
+
+
+# Print where startup time goes: python startup_report.py [entry_point ...]
+if __name__ == "__main__":
+    for entry_point in sys.argv[1:] or ENTRY_POINTS:
+        print_report(entry_point, *measure_startup(entry_point))
@@ -0,0 +1,117 @@
+import threading
+import time
+import pytest
+from flask import Flask, jsonify, request
+import idempotency
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = idempotency.IdempotencyStore(
+        str(tmp_path / "idempotency.db"), ttl=60, max_keys=100, claim_timeout=60
+    )
+    monkeypatch.setattr(idempotency, "idempotency_store", store)
+    return store
+
+
+@pytest.fixture
+def app(store):
+    app = Flask(__name__)
+    app.calls = 0
+    app.release = threading.Event()
+    app.release.set()
+
+    @app.route("/things", methods=["POST"])
+    @idempotency.idempotent
+    def create_thing():
+        app.calls += 1
+        app.release.wait(5)
+        status = request.get_json().get("status", 201)
+        return jsonify({"call": app.calls}), status
+
+    return app
+
+
+def post(app, body, key="key-1"):
+    return app.test_client().post(
+        "/things", json=body, headers={"Idempotency-Key": key}
+    )
+
+
+def test_retry_replays_the_first_response(app):
+    first = post(app, {"name": "a"})
+    retry = post(app, {"name": "a"})
+
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == {"call": 1}
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert app.calls == 1
+
+
+def test_key_reused_for_another_request_is_rejected(app):
+    post(app, {"name": "a"})
+    response = post(app, {"name": "b"})
+
+    assert response.status_code == 422
+    assert app.calls == 1
+
+
+def test_server_errors_are_not_stored(app):
+    assert post(app, {"status": 503}).status_code == 503
+    assert post(app, {"status": 503}).status_code == 503
+    assert app.calls == 2
+
+
+def test_duplicate_waits_for_the_request_in_flight(app, store):
+    app.release.clear()
+    responses = {}
+    first = threading.Thread(
+        target=lambda: responses.update(first=post(app, {"name": "a"}))
+    )
+    first.start()
+    while app.calls == 0:
+        time.sleep(0.01)
+
+    duplicate = threading.Thread(
+        target=lambda: responses.update(duplicate=post(app, {"name": "a"}))
+    )
+    duplicate.start()
+    time.sleep(0.2)
+    assert "duplicate" not in responses  # Still waiting on the first request
+
+    app.release.set()
+    first.join()
+    duplicate.join()
+    assert app.calls == 1
+    assert responses["duplicate"].get_json() == {"call": 1}
+    assert responses["duplicate"].headers["Idempotent-Replayed"] == "true"
+
+
+def test_keys_are_shared_between_worker_processes(store):
+    claim, _ = store.begin("key-1", "fingerprint")
+    assert claim is not None
+
+    # Another worker has its own store object on the same database file
+    other_worker = idempotency.IdempotencyStore(
+        store.db_path, ttl=60, max_keys=100, claim_timeout=60
+    )
+    claim_2, entry = other_worker.begin("key-1", "fingerprint")
+    assert claim_2 is None
+    assert entry["status"] is None
+
+
+def test_claim_of_a_dead_worker_is_taken_over(store):
+    store.begin("key-1", "fingerprint")
+    store.claim_timeout = 0
+
+    claim, _ = store.begin("key-1", "fingerprint")
+    assert claim is not None
+
+
+def test_oldest_keys_are_evicted_beyond_max_keys(app, store):
+    store.max_keys = 2
+    for key in ("key-1", "key-2", "key-3"):
+        post(app, {"name": "a"}, key=key)
+
+    assert post(app, {"name": "a"}, key="key-1").get_json() == {"call": 4}
+    assert post(app, {"name": "a"}, key="key-3").get_json() == {"call": 3}
@@ -0,0 +1,166 @@
+import os
+import sqlite3
+import pytest
+import sharding
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    # Two shard files with the same file name in different directories
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("east")
+    os.makedirs("west")
+    monkeypatch.setattr(sharding, "DB_SHARDS", ["east/users.db", "west/users.db"])
+    monkeypatch.setattr(sharding, "_initialized_slots", set())
+    return tmp_path
+
+
+def add_user(email, slot=None):
+    slot = sharding.get_slot_for_email(email) if slot is None else slot
+    conn = sharding.connect_shard(slot)
+    try:
+        user_id = sharding.allocate_id(conn, slot)
+        conn.execute(
+            "INSERT INTO users (id, first_name, last_name, email, password) VALUES (?, ?, ?, ?, ?)",
+            (user_id, "First", "Last", email, "hash"),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    return user_id
+
+
+# An email whose owner is the given slot
+def email_for_slot(slot, prefix="user"):
+    for n in range(1000):
+        email = f"{prefix}{n}@example.com"
+        if sharding.get_slot_for_email(email) == slot:
+            return email
+    raise AssertionError(f"No email found for slot {slot}")
+
+
+def get_emails(slot):
+    conn = sharding.connect_shard(slot)
+    try:
+        return [row["email"] for row in conn.execute("SELECT email FROM users")]
+    finally:
+        conn.close()
+
+
+def test_shards_with_the_same_file_name_are_distinct(shards):
+    owners = {sharding.get_slot_for_email(f"user{n}@example.com") for n in range(50)}
+    assert owners == {0, 1}
+
+
+def test_routing_ignores_email_case_and_whitespace(shards):
+    assert sharding.get_slot_for_email(" Someone@Example.com ") == (
+        sharding.get_slot_for_email("someone@example.com")
+    )
+
+
+def test_ids_come_from_the_shards_own_range(shards):
+    assert add_user(email_for_slot(0)) == 1
+    assert add_user(email_for_slot(1)) == (1 << sharding.SHARD_ID_BITS) + 1
+
+
+def test_moved_in_users_do_not_shift_the_id_range(shards):
+    moved_id = add_user(email_for_slot(1, "moved"))
+    # Move the slot 1 user onto slot 0 (as an email change would)
+    assert sharding.move_user(moved_id, 1, 0, {"email": email_for_slot(0, "new")})
+
+    assert add_user(email_for_slot(0)) == 1
+    assert sharding.locate_id(moved_id) == 0
+
+
+def test_existing_rows_seed_the_id_sequence(shards):
+    conn = sqlite3.connect("east/users.db")
+    conn.execute(sharding.USERS_SCHEMA)
+    conn.execute(
+        "INSERT INTO users (id, first_name, last_name, email, password) "
+        "VALUES (41, 'Legacy', 'User', 'legacy@example.com', 'hash')"
+    )
+    conn.commit()
+    conn.close()
+
+    assert add_user(email_for_slot(0)) == 42
+
+
+def test_email_change_rehomes_the_user(shards):
+    user_id = add_user(email_for_slot(0))
+    new_email = email_for_slot(1, "new")
+
+    assert sharding.update_user_row(user_id, {"email": new_email}) == 1
+    assert sharding.locate_id(user_id) == 1
+    assert get_emails(0) == []
+    assert get_emails(1) == [new_email]
+
+    users = sharding.fetch_all("SELECT id, email FROM users ORDER BY id")
+    assert [(row["id"], row["email"]) for row in users] == [(user_id, new_email)]
+
+
+def test_rehoming_back_to_the_origin_drops_the_redirect(shards):
+    user_id = add_user(email_for_slot(0))
+    sharding.update_user_row(user_id, {"email": email_for_slot(1, "away")})
+    assert sharding.update_user_row(user_id, {"email": email_for_slot(0, "home")}) == 0
+
+    conn = sharding.connect_shard(0)
+    assert conn.execute("SELECT * FROM moved_users").fetchall() == []
+    conn.close()
+    assert sharding.locate_id(user_id) == 0
+
+
+def test_email_taken_on_another_shard_is_rejected(shards):
+    taken = email_for_slot(1, "taken")
+    add_user(taken)
+    user_id = add_user(email_for_slot(0))
+
+    with pytest.raises(sqlite3.IntegrityError) as error:
+        sharding.update_user_row(user_id, {"email": taken})
+    assert sharding.is_email_taken(error.value)
+    assert sharding.locate_id(user_id) == 0
+    assert get_emails(1) == [taken]
+
+
+def test_update_and_delete_a_moved_user(shards):
+    user_id = add_user(email_for_slot(0))
+    sharding.update_user_row(user_id, {"email": email_for_slot(1, "moved")})
+
+    assert sharding.update_user_row(user_id, {"first_name": "Changed"}) == 1
+    assert sharding.delete_user_row(user_id)
+    assert not sharding.delete_user_row(user_id)
+    assert sharding.update_user_row(user_id, {"first_name": "Gone"}) is None
+
+    conn = sharding.connect_shard(0)
+    assert conn.execute("SELECT * FROM moved_users").fetchall() == []
+    conn.close()
+
+
+def test_rebalance_moves_users_to_their_owner(shards):
+    user_ids = [add_user(email_for_slot(1, f"u{n}_"), slot=0) for n in range(3)]
+
+    assert sharding.rebalance(batch_size=2) == 3
+    assert get_emails(0) == []
+    assert [sharding.locate_id(user_id) for user_id in user_ids] == [1, 1, 1]
+
+
+def test_new_shard_files_use_wal_and_incremental_vacuum(shards):
+    for slot in (0, 1):
+        conn = sharding.connect_shard(slot)
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        conn.close()
+
+
+def test_single_database_is_left_unchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sharding, "DB_SHARDS", [])
+    conn = sqlite3.connect("database.db")
+    conn.execute(sharding.USERS_SCHEMA)
+    conn.close()
+
+    conn = sharding.connect_shard(0)
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    conn.close()
+    assert "moved_users" not in tables
+    assert "id_sequence" not in tables
+    assert sharding.allocate_id(None, 0) is None
@@ -1,18 +1,59 @@
 from flask import Blueprint, request, jsonify
 from flasgger import swag_from
 from werkzeug.security import generate_password_hash, check_password_hash
-from db import get_db_connection
+from sharding import (
+    allocate_id,
+    connect_shard,
+    delete_user_row,
+    fetch_all,
+    is_email_taken,
+    locate_email,
+    locate_id,
+    update_user_row,
+)
+from deadlines import check_deadline, with_deadline
+from idempotency import idempotent, IDEMPOTENCY_KEY_PARAMETER
 import sqlite3
 
 
 # Create a Blueprint for users
 users_bp = Blueprint("users", __name__)
 
+# Columns a client may request with ?fields= (never the password hash)
+USER_FIELDS = ("id", "first_name", "last_name", "email", "role", "avatar")
+
+# Swagger description of the ?fields= query parameter
+FIELDS_PARAMETER = {
+    "name": "fields",
+    "in": "query",
+    "type": "string",
+    "required": False,
+    "description": "Comma-separated list of fields to return, e.g. id,first_name",
+}
+
+
+# Resolve ?fields= against the allowlist into a SELECT column list
+def get_selected_fields():
+    fields = request.args.get("fields")
+    if not fields:
+        return USER_FIELDS, None
+
+    selected = []
+    for field in fields.split(","):
+        field = field.strip()
+        if field not in USER_FIELDS:
+            return None, f"Unknown field: {field}"
+        if field not in selected:
+            selected.append(field)
+    return tuple(selected), None
+
 
 # Route to get all users (Read operation)
 @users_bp.route("/users", methods=["GET"])
+@with_deadline(5)
 @swag_from(
     {
+        "parameters": [FIELDS_PARAMETER],
         "responses": {
             200: {
                 "description": "A list of all users",
@@ -35,12 +76,14 @@ users_bp = Blueprint("users", __name__)
     }
 )
 def get_users():
-    conn = get_db_connection()
-    users = conn.execute(
-        "SELECT id, first_name, last_name, email, role, avatar FROM users"
-    ).fetchall()
+    fields, error = get_selected_fields()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Fanned out to every shard; ordering by id lets the shards' rows be merged
+    order_by = " ORDER BY id" if "id" in fields else ""
+    users = fetch_all(f"SELECT {', '.join(fields)} FROM users{order_by}")
 
-    conn.close()
     return jsonify([dict(row) for row in users])
 
 
@@ -55,7 +98,8 @@ def get_users():
                 "type": "integer",
                 "required": True,
                 "description": "ID of the user to retrieve",
-            }
+            },
+            FIELDS_PARAMETER,
         ],
         "responses": {
             200: {
@@ -77,12 +121,18 @@ def get_users():
     }
 )
 def get_user(user_id):
-    conn = get_db_connection()
-    user = conn.execute(
-        "SELECT id, first_name, last_name, email, role, avatar FROM users WHERE id = ?",
-        (user_id,),
-    ).fetchone()
-    conn.close()
+    fields, error = get_selected_fields()
+    if error:
+        return jsonify({"error": error}), 400
+
+    conn = connect_shard(locate_id(user_id))
+    try:
+        user = conn.execute(
+            f"SELECT {', '.join(fields)} FROM users WHERE id = ?",
+            (user_id,),
+        ).fetchone()
+    finally:
+        conn.close()
     if user is None:
         return jsonify({"error": "User not found"}), 404
     return jsonify(dict(user))
@@ -90,9 +140,11 @@ def get_user(user_id):
 
 # Route to create a new user (Create operation)
 @users_bp.route("/users", methods=["POST"])
+@idempotent
 @swag_from(
     {
         "parameters": [
+            IDEMPOTENCY_KEY_PARAMETER,
             {
                 "name": "body",
                 "in": "body",
@@ -125,28 +177,49 @@ def create_user():
     role = new_user.get("role")
     avatar = new_user.get("avatar")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    slot = locate_email(email)
 
     # Check if the user already exists
-    existing_user = cursor.execute(
-        "SELECT * FROM users WHERE email = ?", (email,)
-    ).fetchone()
-    if existing_user:
+    conn = connect_shard(slot)
+    try:
+        existing_user = conn.execute(
+            "SELECT 1 FROM users WHERE email = ?", (email,)
+        ).fetchone()
+    finally:
         conn.close()
+    if existing_user:
         return jsonify({"error": "User already exists"}), 400
 
+    # Don't start hashing if the request has already run out of time; no
+    # connection is held while the password is hashed
+    check_deadline()
+
     # Hash the password for security
     hashed_password = generate_password_hash(password)
 
     # Insert the new user into the database
-    cursor.execute(
-        "INSERT INTO users (first_name, last_name, email, password, role, avatar) VALUES (?, ?, ?, ?, ?, ?)",
-        (first_name, last_name, email, hashed_password, role, avatar),
-    )
-
-    conn.commit()
-    conn.close()
+    conn = connect_shard(slot)
+    try:
+        conn.execute(
+            "INSERT INTO users (id, first_name, last_name, email, password, role, avatar) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                allocate_id(conn, slot),
+                first_name,
+                last_name,
+                email,
+                hashed_password,
+                role,
+                avatar,
+            ),
+        )
+        conn.commit()
+    except sqlite3.IntegrityError as e:
+        if not is_email_taken(e):
+            raise
+        # Created by a concurrent request while the password was being hashed
+        return jsonify({"error": "User already exists"}), 400
+    finally:
+        conn.close()
 
     return jsonify({"message": "User created successfully"}), 201
 
@@ -187,18 +260,21 @@ def update_user(user_id):
     email = updated_user.get("email")
     avatar = updated_user.get("avatar")
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        UPDATE users
-        SET first_name = ?, last_name = ?, email = ?, avatar = ?
-        WHERE id = ?
-    """,
-        (first_name, last_name, email, avatar, user_id),
-    )
-    conn.commit()
-    conn.close()
+    # Moves the user too when the new email hashes to a different shard
+    try:
+        update_user_row(
+            user_id,
+            {
+                "first_name": first_name,
+                "last_name": last_name,
+                "email": email,
+                "avatar": avatar,
+            },
+        )
+    except sqlite3.IntegrityError as e:
+        if not is_email_taken(e):
+            raise
+        return jsonify({"error": "User already exists"}), 400
 
     return jsonify({"message": "User updated successfully"})
 
@@ -221,12 +297,7 @@ def update_user(user_id):
 )
 def delete_user(user_id):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        conn.commit()
-        conn.close()
-        if cursor.rowcount == 0:
+        if not delete_user_row(user_id):
             return jsonify({"error": "User not found"}), 404  # User ID not found
         return jsonify({"message": "User deleted successfully"}), 200
     except sqlite3.Error as e:
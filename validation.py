@@ -0,0 +1,70 @@
+from flask import request, jsonify
+from jsonschema import Draft4Validator
+from admin import check_admin
+
+# Compiled body validators, keyed by endpoint name (e.g. "users.create_user")
+_validators = {}
+# Endpoints behind admin_required: callers are authenticated before validation
+_admin_endpoints = set()
+
+
+# Pull the JSON body schema out of a route's @swag_from/@swag_specs specs (if any)
+def get_body_schema(view_func):
+    specs = getattr(view_func, "specs_dict", None) or {}
+    for parameter in specs.get("parameters", []):
+        if parameter.get("in") == "body" and "schema" in parameter:
+            return parameter["schema"]
+    return None
+
+
+# Compile every route's body schema once and validate incoming bodies with it
+def init_validation(app):
+    for endpoint, view_func in app.view_functions.items():
+        schema = get_body_schema(view_func)
+        if schema is None:
+            continue
+        # Swagger 2.0 schemas are a subset of JSON Schema draft 4
+        Draft4Validator.check_schema(schema)
+        _validators[endpoint] = Draft4Validator(schema)
+        if getattr(view_func, "admin_required", False):
+            _admin_endpoints.add(endpoint)
+
+    app.before_request(validate_request_body)
+
+
+# Reject malformed bodies before the view touches the database or hashes anything
+def validate_request_body():
+    validator = _validators.get(request.endpoint)
+    if validator is None or request.method in ("GET", "HEAD", "OPTIONS"):
+        return None
+
+    # Don't describe the schema to callers who may not use the route
+    if request.endpoint in _admin_endpoints:
+        error = check_admin()
+        if error:
+            return error
+
+    data = request.get_json(silent=True)
+    if data is None:
+        return (
+            jsonify(
+                {
+                    "error": "Invalid request body",
+                    "details": [{"path": "", "message": "Body must be valid JSON"}],
+                }
+            ),
+            400,
+        )
+
+    errors = sorted(validator.iter_errors(data), key=lambda e: list(e.path))
+    if not errors:
+        return None
+
+    details = [
+        {
+            "path": "/".join(str(part) for part in error.path),
+            "message": error.message,
+        }
+        for error in errors
+    ]
+    return jsonify({"error": "Invalid request body", "details": details}), 400